@@ -1,76 +1,733 @@
 from __future__ import annotations
 
+import argparse
+import csv
+import hashlib
+import io
+import json
 import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields, is_dataclass
+from functools import partial
+from multiprocessing.pool import AsyncResult
 from pathlib import Path
-from typing import List
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 import ezdxf
-from ezdxf import disassemble
-from ezdxf.render import path
+import numpy as np
+from numpy.typing import ArrayLike
+from ezdxf.addons.r12writer import R12FastStreamWriter, r12writer
+from ezdxf.document import Drawing
+from ezdxf.entities import Hatch
+from ezdxf.layouts import BaseLayout
+from ezdxf.lldxf import const
+from ezdxf.math import BoundingBox2d, Vec3
 from ezdxf.render.forms import box, translate
 
 DIR = Path(".")
 
 
+# Frames, holes, perforations and rectangle specs are frozen, slotted value
+# classes: no per-instance __dict__, and hashable for memoization and dedup.
+@dataclass(frozen=True, slots=True)
 class L_frame:
-    def __init__(
-        self,
+    width: float
+    horizontal_length: float
+    vertical_length: float
+    angle: float
+    thickness: float = 1.0
+    material: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class U_frame:
+    width: float
+    horizontal_length: float
+    vertical_length_left: float
+    vertical_length_right: float
+    angle_left: float
+    angle_right: float
+    thickness: float = 1.0
+    material: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class Profile:
+    # Strip of `width` bent along its length into a chain of flanges:
+    # bends[i] joins flanges[i] and flanges[i + 1]. Covers Z, hat, box and
+    # any other open profile; lengths are outside dimensions like the frames
+    width: float
+    flanges: Tuple[float, ...]
+    bends: Tuple[float, ...]
+    thickness: float = 1.0
+    material: str = ""
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "flanges", tuple(float(f) for f in self.flanges))
+        object.__setattr__(self, "bends", tuple(float(b) for b in self.bends))
+        if len(self.bends) != len(self.flanges) - 1:
+            raise ValueError(
+                f"{len(self.flanges)} flanges need {len(self.flanges) - 1} bends,"
+                f" got {len(self.bends)}"
+            )
+
+    @staticmethod
+    def z(
         width: float,
-        horizontal_length: float,
-        vertical_length: float,
-        angle: float,
+        bottom: float,
+        web: float,
+        top: float,
+        angle: float = 90,
         thickness: float = 1.0,
-    ) -> None:
-        self.width = width
-        self.horizontal_length = horizontal_length
-        self.vertical_length = vertical_length
-        self.angle = angle
-        self.thickness = thickness
+        material: str = "",
+    ) -> Profile:
+        return Profile(width, (bottom, web, top), (angle, angle), thickness, material)
 
+    @staticmethod
+    def hat(
+        width: float,
+        brim: float,
+        wall: float,
+        top: float,
+        angle: float = 90,
+        thickness: float = 1.0,
+        material: str = "",
+    ) -> Profile:
+        return Profile(
+            width, (brim, wall, top, wall, brim), (angle,) * 4, thickness, material
+        )
 
-class U_frame:
-    def __init__(
-        self,
+    @staticmethod
+    def box(
         width: float,
-        horizontal_length: float,
-        vertical_length_left: float,
-        vertical_length_right: float,
-        angle_left: float,
-        angle_right: float,
+        base: float,
+        side: float,
+        lip: float,
+        angle: float = 90,
         thickness: float = 1.0,
+        material: str = "",
+    ) -> Profile:
+        # Channel with both sides returned inwards by a lip
+        return Profile(
+            width, (lip, side, base, side, lip), (angle,) * 4, thickness, material
+        )
+
+
+_Frame = Union[L_frame, U_frame, Profile]
+
+_Curve = Tuple[np.ndarray, np.ndarray]
+
+
+class BendTable:
+    # Bend deductions keyed by material, thickness and bend angle (degrees).
+    # Rows are indexed per material and thickness into sorted angle arrays;
+    # values in between are interpolated (linear in angle, then thickness)
+    # and memoized. Unknown materials raise KeyError and lookups outside the
+    # table ValueError, unless fallback uses the rows without a material and
+    # clamp takes the nearest table edge.
+    def __init__(
+        self,
+        rows: Iterable[Tuple[str, float, float, float]],
+        fallback: bool = False,
+        clamp: bool = False,
     ) -> None:
-        self.width = width
-        self.horizontal_length = horizontal_length
-        self.vertical_length_left = vertical_length_left
-        self.vertical_length_right = vertical_length_right
-        self.angle_left = angle_left
-        self.angle_right = angle_right
-        self.thickness = thickness
+        self.fallback = fallback
+        self.clamp = clamp
+        grouped: Dict[str, Dict[float, Dict[float, float]]] = {}
+        for material, thickness, angle, deduction in rows:
+            grouped.setdefault(material, {}).setdefault(float(thickness), {})[
+                float(angle)
+            ] = float(deduction)
+
+        # material -> (sorted thicknesses, (angles, deductions) per thickness)
+        self._index: Dict[str, Tuple[np.ndarray, List[_Curve]]] = {}
+        for material, by_thickness in grouped.items():
+            thicknesses = sorted(by_thickness)
+            curves = []
+            for thickness in thicknesses:
+                angles = sorted(by_thickness[thickness])
+                curves.append(
+                    (
+                        np.array(angles),
+                        np.array([by_thickness[thickness][a] for a in angles]),
+                    )
+                )
+            self._index[material] = (np.array(thicknesses), curves)
+        self._memo: Dict[Tuple[str, float, float], float] = {}
+
+    @staticmethod
+    def load(
+        filename: Union[str, Path], fallback: bool = False, clamp: bool = False
+    ) -> BendTable:
+        # CSV with material, thickness, angle and either a deduction column or
+        # k_factor and inside_radius columns to compute it from
+        rows = []
+        with open(filename, newline="") as stream:
+            for row in csv.DictReader(stream):
+                thickness = float(row["thickness"])
+                angle = float(row["angle"])
+                if row.get("deduction"):
+                    deduction = float(row["deduction"])
+                else:
+                    deduction = deduction_from_k_factor(
+                        thickness,
+                        angle,
+                        float(row["k_factor"]),
+                        float(row["inside_radius"]),
+                    )
+                rows.append((row.get("material") or "", thickness, angle, deduction))
+        return BendTable(rows, fallback, clamp)
+
+    def deduction(self, thickness: float, angle: float, material: str = "") -> float:
+        key = (material, float(thickness), float(angle))
+        if key not in self._memo:
+            self._memo[key] = self._interpolate(*key)
+        return self._memo[key]
+
+    def deductions(
+        self, thickness: ArrayLike, angle: ArrayLike, material: str = ""
+    ) -> np.ndarray:
+        # Vectorized lookup: each unique (thickness, angle) pair is resolved
+        # once and scattered back to the input shape
+        thickness, angle = np.broadcast_arrays(
+            np.asarray(thickness, dtype=float), np.asarray(angle, dtype=float)
+        )
+        pairs, inverse = np.unique(
+            np.stack([thickness.ravel(), angle.ravel()], axis=1),
+            axis=0,
+            return_inverse=True,
+        )
+        values = np.array(
+            [self.deduction(t, a, material) for t, a in pairs.tolist()], dtype=float
+        )
+        return values[inverse.reshape(-1)].reshape(thickness.shape)
+
+    def _interpolate(self, material: str, thickness: float, angle: float) -> float:
+        if material not in self._index:
+            if not self.fallback or "" not in self._index:
+                raise KeyError(f"no bend deductions for material {material!r}")
+            material = ""
+        thicknesses, curves = self._index[material]
+        if not self.clamp and not thicknesses[0] <= thickness <= thicknesses[-1]:
+            raise ValueError(
+                f"thickness {thickness} outside the bend table for {material!r}"
+            )
+        # Only the curves of the thicknesses around the lookup are used
+        upper = min(int(np.searchsorted(thicknesses, thickness)), len(curves) - 1)
+        lower = upper - 1 if upper > 0 and thicknesses[upper] != thickness else upper
+        values = []
+        for index in (lower, upper):
+            angles, deductions = curves[index]
+            if not self.clamp and not angles[0] <= angle <= angles[-1]:
+                raise ValueError(
+                    f"angle {angle} outside the bend table for {material!r}"
+                    f" at thickness {thicknesses[index]}"
+                )
+            values.append(float(np.interp(angle, angles, deductions)))
+        if lower == upper:
+            return values[0]
+        return float(np.interp(thickness, thicknesses[[lower, upper]], values))
+
+
+def deduction_from_k_factor(
+    thickness: float, angle: float, k_factor: float, inside_radius: float
+) -> float:
+    # Bend deduction = 2 * outside setback - bend allowance
+    outside_setback = math.tan(math.radians(angle) / 2) * (inside_radius + thickness)
+    bend_allowance = math.radians(angle) * (inside_radius + k_factor * thickness)
+    return 2 * outside_setback - bend_allowance
 
 
+def bend_deduction(
+    angle: float,
+    thickness: float = 1.0,
+    material: str = "",
+    bend_table: Optional[BendTable] = None,
+) -> float:
+    # Without a table the original fixed rule is used
+    if bend_table is None:
+        return 1 if angle == 90 else 0.5
+    return bend_table.deduction(thickness, angle, material)
+
+
+def bend_deductions(
+    angle: ArrayLike,
+    thickness: ArrayLike = 1.0,
+    material: Union[str, ArrayLike] = "",
+    bend_table: Optional[BendTable] = None,
+) -> np.ndarray:
+    # Columnar bend_deduction(): same rules, one value per element
+    angle = np.asarray(angle, dtype=float)
+    if bend_table is None:
+        return np.where(angle == 90, 1.0, 0.5)
+    thickness, angle = np.broadcast_arrays(np.asarray(thickness, dtype=float), angle)
+    materials = np.asarray(material, dtype=str)
+    if materials.ndim == 0:
+        return bend_table.deductions(thickness, angle, str(materials))
+    materials = np.broadcast_to(materials, angle.shape)
+    result = np.empty(angle.shape)
+    for name in np.unique(materials).tolist():
+        mask = materials == name
+        result[mask] = bend_table.deductions(thickness[mask], angle[mask], name)
+    return result
+
+
+def flat_pattern_L(
+    width: ArrayLike,
+    horizontal_length: ArrayLike,
+    vertical_length: ArrayLike,
+    angle: ArrayLike,
+    thickness: ArrayLike = 1.0,
+    material: Union[str, ArrayLike] = "",
+    bend_table: Optional[BendTable] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # (width, height) of the flat rectangles for arrays of L_frame fields,
+    # matching Rectangle.from_L_frame element by element
+    height = (
+        np.asarray(horizontal_length, dtype=float)
+        + np.asarray(vertical_length, dtype=float)
+        - bend_deductions(angle, thickness, material, bend_table)
+    )
+    return np.broadcast_arrays(np.asarray(width, dtype=float), height)
+
+
+def flat_pattern_U(
+    width: ArrayLike,
+    horizontal_length: ArrayLike,
+    vertical_length_left: ArrayLike,
+    vertical_length_right: ArrayLike,
+    angle_left: ArrayLike,
+    angle_right: ArrayLike,
+    thickness: ArrayLike = 1.0,
+    material: Union[str, ArrayLike] = "",
+    bend_table: Optional[BendTable] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    # (width, height) of the flat rectangles for arrays of U_frame fields,
+    # matching Rectangle.from_U_frame element by element
+    height = (
+        np.asarray(horizontal_length, dtype=float)
+        + np.asarray(vertical_length_left, dtype=float)
+        + np.asarray(vertical_length_right, dtype=float)
+        - bend_deductions(angle_left, thickness, material, bend_table)
+        - bend_deductions(angle_right, thickness, material, bend_table)
+    )
+    return np.broadcast_arrays(np.asarray(width, dtype=float), height)
+
+
+@dataclass(frozen=True, slots=True)
 class Hole:
-    def __init__(self) -> None:
-        self.width: float = 0.0
-        self.height: float = 0.0
+    width: float = field(default=0.0, init=False, repr=False)
+    height: float = field(default=0.0, init=False, repr=False)
+
+    def key(self) -> Tuple:
+        # Holes with the same key have the same geometry
+        return (type(self).__name__,)
+
+    def circles(
+        self, center_x: float, center_y: float
+    ) -> List[Tuple[float, float, float]]:
+        # (x, y, radius) of every circle to cut for this hole
+        return []
 
 
+@dataclass(frozen=True, slots=True)
 class Circle(Hole):
-    def __init__(self, radius: float) -> None:
-        self.radius = radius
-        self.height = self.radius * 2
-        self.width = self.radius * 2
+    radius: float
 
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "height", self.radius * 2)
+        object.__setattr__(self, "width", self.radius * 2)
 
+    def key(self) -> Tuple:
+        return ("Circle", self.radius)
+
+    def circles(
+        self, center_x: float, center_y: float
+    ) -> List[Tuple[float, float, float]]:
+        return [(center_x, center_y, self.radius)]
+
+
+@dataclass(frozen=True, slots=True)
 class Slot(Hole):
-    def __init__(self, radius: float, length: float, angle: float) -> None:
-        self.radius = radius
-        self.length = length  # distance beteen end radii
-        self.angle = angle
-        self.height = (self.length * math.sin(self.angle)) + (2 * self.radius)
-        self.width = (self.length * math.cos(self.angle)) + (2 * self.radius)
+    radius: float
+    length: float  # distance beteen end radii
+    angle: float
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self, "height", (self.length * math.sin(self.angle)) + (2 * self.radius)
+        )
+        object.__setattr__(
+            self, "width", (self.length * math.cos(self.angle)) + (2 * self.radius)
+        )
+
+    def key(self) -> Tuple:
+        return ("Slot", self.radius, self.length, self.angle)
+
+    def circles(
+        self, center_x: float, center_y: float
+    ) -> List[Tuple[float, float, float]]:
+        # TODO doesn't work correctly yet
+        # TODO add lines connecting circles
+        left_x = center_x - ((self.length / 2) * math.cos(self.angle))
+        left_y = center_y + ((self.length / 2) * math.sin(self.angle))
+        right_x = center_x + ((self.length / 2) * math.cos(self.angle))
+        right_y = center_y - ((self.length / 2) * math.sin(self.angle))
+        return [(left_x, left_y, self.radius), (right_x, right_y, self.radius)]
+
+
+class HoleSet:
+    # Array backed hole collection: one typed array per attribute instead of a
+    # Python object per hole. Indexing and iterating give Circle/Slot objects,
+    # slicing gives a new HoleSet.
+    CIRCLE = 0
+    SLOT = 1
+    _ARRAYS = ("_kind", "_radius", "_length", "_angle", "_width", "_height")
+
+    def __init__(self, holes: Iterable[Hole] = ()) -> None:
+        self._size = 0
+        self._kind = np.empty(0, dtype=np.uint8)
+        self._radius = np.empty(0, dtype=np.float64)
+        self._length = np.empty(0, dtype=np.float64)
+        self._angle = np.empty(0, dtype=np.float64)
+        self._width = np.empty(0, dtype=np.float64)
+        self._height = np.empty(0, dtype=np.float64)
+        self.extend(holes)
+
+    @staticmethod
+    def from_arrays(
+        kind: ArrayLike,
+        radius: ArrayLike,
+        length: ArrayLike = 0.0,
+        angle: ArrayLike = 0.0,
+    ) -> HoleSet:
+        hole_set = HoleSet()
+        hole_set.extend_arrays(kind, radius, length, angle)
+        return hole_set
+
+    @property
+    def kind(self) -> np.ndarray:
+        return self._kind[: self._size]
+
+    @property
+    def radius(self) -> np.ndarray:
+        return self._radius[: self._size]
+
+    @property
+    def length(self) -> np.ndarray:
+        return self._length[: self._size]
+
+    @property
+    def angle(self) -> np.ndarray:
+        return self._angle[: self._size]
+
+    @property
+    def width(self) -> np.ndarray:
+        return self._width[: self._size]
+
+    @property
+    def height(self) -> np.ndarray:
+        return self._height[: self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Hole]:
+        for kind, radius, length, angle in zip(
+            self.kind.tolist(),
+            self.radius.tolist(),
+            self.length.tolist(),
+            self.angle.tolist(),
+        ):
+            yield self._hole(kind, radius, length, angle)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Hole, HoleSet]:
+        if isinstance(index, slice):
+            return HoleSet.from_arrays(
+                self.kind[index],
+                self.radius[index],
+                self.length[index],
+                self.angle[index],
+            )
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("hole index out of range")
+        return self._hole(
+            int(self._kind[index]),
+            float(self._radius[index]),
+            float(self._length[index]),
+            float(self._angle[index]),
+        )
+
+    @staticmethod
+    def _hole(kind: int, radius: float, length: float, angle: float) -> Hole:
+        if kind == HoleSet.CIRCLE:
+            return Circle(radius)
+        if kind == HoleSet.SLOT:
+            return Slot(radius, length, angle)
+        raise ValueError(f"unknown hole kind {kind}")
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._kind)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 8)
+        for name in self._ARRAYS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self._size] = old[: self._size]
+            setattr(self, name, new)
+
+    def append(self, hole: Hole) -> None:
+        self.extend([hole])
+
+    def extend(self, holes: Iterable[Hole]) -> None:
+        if isinstance(holes, HoleSet):
+            self.extend_arrays(holes.kind, holes.radius, holes.length, holes.angle)
+            return
+        rows = []
+        for hole in holes:
+            if isinstance(hole, Circle):
+                rows.append((HoleSet.CIRCLE, hole.radius, 0.0, 0.0))
+            elif isinstance(hole, Slot):
+                rows.append((HoleSet.SLOT, hole.radius, hole.length, hole.angle))
+            else:
+                raise TypeError(f"unsupported hole type {type(hole).__name__}")
+        if rows:
+            kind, radius, length, angle = zip(*rows)
+            self.extend_arrays(kind, radius, length, angle)
+
+    def extend_arrays(
+        self,
+        kind: ArrayLike,
+        radius: ArrayLike,
+        length: ArrayLike = 0.0,
+        angle: ArrayLike = 0.0,
+    ) -> None:
+        # Bulk append, width and height follow the Circle/Slot formulas
+        kind = np.asarray(kind)
+        unknown = ~np.isin(kind, (HoleSet.CIRCLE, HoleSet.SLOT))
+        if unknown.any():
+            raise ValueError(f"unknown hole kind {kind[unknown].ravel()[0].item()}")
+        kind, radius, length, angle = np.broadcast_arrays(
+            kind.astype(np.uint8),
+            np.asarray(radius, dtype=np.float64),
+            np.asarray(length, dtype=np.float64),
+            np.asarray(angle, dtype=np.float64),
+        )
+        is_slot = kind == HoleSet.SLOT
+        width = np.where(is_slot, length * np.cos(angle), 0.0) + (2 * radius)
+        height = np.where(is_slot, length * np.sin(angle), 0.0) + (2 * radius)
+        start = self._size
+        end = start + len(kind)
+        self._reserve(end)
+        self._kind[start:end] = kind
+        self._radius[start:end] = radius
+        self._length[start:end] = np.where(is_slot, length, 0.0)
+        self._angle[start:end] = np.where(is_slot, angle, 0.0)
+        self._width[start:end] = width
+        self._height[start:end] = height
+        self._size = end
+
+    def truncate(self, size: int) -> None:
+        self._size = min(size, self._size)
+
+    def tobytes(self) -> bytes:
+        # Canonical byte representation, e.g. for hashing
+        return b"".join(
+            getattr(self, name)[: self._size].tobytes()
+            for name in ("_kind", "_radius", "_length", "_angle")
+        )
+
+
+class FrozenHoleSet(HoleSet):
+    # Read-only HoleSet held by RectangleSpec. Equality and hash go through
+    # tobytes(), so specs dedup, hash and validate without a Python object
+    # per hole.
+    def __init__(self, holes: Iterable[Hole] = ()) -> None:
+        self._frozen = False
+        super().__init__(holes)
+        for name in self._ARRAYS:
+            array = getattr(self, name)[: self._size].copy()
+            array.flags.writeable = False
+            setattr(self, name, array)
+        self._bytes = self.tobytes()
+        self._frozen = True
+
+    def extend_arrays(
+        self,
+        kind: ArrayLike,
+        radius: ArrayLike,
+        length: ArrayLike = 0.0,
+        angle: ArrayLike = 0.0,
+    ) -> None:
+        if self._frozen:
+            raise TypeError("FrozenHoleSet is read-only")
+        super().extend_arrays(kind, radius, length, angle)
+
+    def truncate(self, size: int) -> None:
+        raise TypeError("FrozenHoleSet is read-only")
+
+    def tobytes(self) -> bytes:
+        if self._frozen:
+            return self._bytes
+        return super().tobytes()
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, FrozenHoleSet):
+            return NotImplemented
+        return self._bytes == other._bytes
+
+    def __hash__(self) -> int:
+        return hash(self._bytes)
+
+    def __repr__(self) -> str:
+        return f"FrozenHoleSet({list(self)!r})"
+
+
+@dataclass(frozen=True, slots=True)
+class Perforation:
+    # Regular grid of identical holes, rows x columns with pitch_x / pitch_y
+    # between hole centers. With stagger every second row is shifted by half
+    # of pitch_x.
+    hole: Hole
+    rows: int
+    columns: int
+    pitch_x: float
+    pitch_y: float
+    stagger: bool = False
+    width: float = field(default=0.0, init=False, repr=False)
+    height: float = field(default=0.0, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self,
+            "width",
+            (self.columns - 1) * self.pitch_x
+            + self.hole.width
+            + (self.pitch_x / 2 if self.stagger and self.rows > 1 else 0),
+        )
+        object.__setattr__(
+            self, "height", (self.rows - 1) * self.pitch_y + self.hole.height
+        )
+
+    def grids(
+        self, first_x: float, first_y: float
+    ) -> List[Tuple[float, float, int, float]]:
+        # (x, y, rows, row_spacing) of the plain grids making up the pattern,
+        # starting from the center of the first hole
+        if not self.stagger or self.rows == 1:
+            return [(first_x, first_y, self.rows, self.pitch_y)]
+        return [
+            (first_x, first_y, (self.rows + 1) // 2, 2 * self.pitch_y),
+            (
+                first_x + self.pitch_x / 2,
+                first_y + self.pitch_y,
+                self.rows // 2,
+                2 * self.pitch_y,
+            ),
+        ]
+
+    def centers(self, first_x: float, first_y: float) -> Tuple[np.ndarray, np.ndarray]:
+        # x and y arrays of all hole centers
+        xs, ys = [], []
+        for x, y, rows, row_spacing in self.grids(first_x, first_y):
+            grid_x, grid_y = np.meshgrid(
+                x + np.arange(self.columns) * self.pitch_x,
+                y + np.arange(rows) * row_spacing,
+            )
+            xs.append(grid_x.ravel())
+            ys.append(grid_y.ravel())
+        return np.concatenate(xs), np.concatenate(ys)
+
+
+@dataclass(frozen=True, slots=True)
+class Violation:
+    # One failed constraint: index of the rectangle in the validated batch and
+    # of the offending hole (None if it concerns the rectangle as a whole)
+    rectangle: int
+    hole: Optional[int]
+    code: str
+    message: str
+
+
+class HoleFitError(ValueError):
+    def __init__(self, violations: List[Violation]) -> None:
+        super().__init__("; ".join(violation.message for violation in violations))
+        self.violations = violations
+
+
+@dataclass(frozen=True, slots=True)
+class RectangleSpec:
+    # Frozen, hashable snapshot of a Rectangle, see Rectangle.spec()
+    width: float
+    height: float
+    offset_from_side: float = 0
+    offset_from_bottom: float = 0
+    thickness: float = 1
+    holes: FrozenHoleSet = field(default_factory=FrozenHoleSet)
+    perforation: Optional[Perforation] = None
+    frame: Optional[_Frame] = None
+
+    def __post_init__(self) -> None:
+        # Any iterable of holes is accepted and stored in array form
+        if not isinstance(self.holes, FrozenHoleSet):
+            object.__setattr__(self, "holes", FrozenHoleSet(self.holes))
+
+    def to_rectangle(self, check: bool = True) -> Rectangle:
+        rectangle = Rectangle(
+            self.width,
+            self.height,
+            self.offset_from_side,
+            self.offset_from_bottom,
+            self.thickness,
+        )
+        rectangle.frame = self.frame
+        if self.holes:
+            rectangle.add_holes(self.holes, check)
+        if self.perforation is not None:
+            rectangle.add_perforation(self.perforation, check)
+        return rectangle
+
+    def validate(self) -> List[Violation]:
+        return validate_rectangles([self])
 
 
 class Rectangle:
+    __slots__ = (
+        "width",
+        "height",
+        "thickness",
+        "offset_from_side",
+        "offset_from_bottom",
+        "holes",
+        "perforation",
+        "frame",
+    )
+
     def __init__(
         self,
         width: float,
@@ -85,141 +742,1699 @@ class Rectangle:
         self.offset_from_side = offset_from_side # offset until edge of hole, not center
         self.offset_from_bottom = offset_from_bottom
 
-        self.holes: List[Hole] = []
-        self.holes_total_width: float = 0.0
+        self.holes = HoleSet()
+        self.perforation: Optional[Perforation] = None
+        # Frame the rectangle was unfolded from, part of its spec
+        self.frame: Optional[_Frame] = None
 
     @staticmethod
-    def from_L_frame(l_frame: L_frame) -> Rectangle:
-        # replace with formula used in Excel
+    def from_L_frame(
+        l_frame: L_frame, bend_table: Optional[BendTable] = None
+    ) -> Rectangle:
         height = (
             l_frame.horizontal_length
             + l_frame.vertical_length
-            - (1 if l_frame.angle == 90 else 0.5)
+            - bend_deduction(
+                l_frame.angle, l_frame.thickness, l_frame.material, bend_table
+            )
         )
-        return Rectangle(l_frame.width, height, l_frame.thickness)
+        rectangle = Rectangle(l_frame.width, height, thickness=l_frame.thickness)
+        rectangle.frame = l_frame
+        return rectangle
 
     @staticmethod
-    def from_U_frame(u_frame: U_frame) -> Rectangle:
-        # replace with formula used in Excel
+    def from_U_frame(
+        u_frame: U_frame, bend_table: Optional[BendTable] = None
+    ) -> Rectangle:
         height = (
             u_frame.horizontal_length
             + u_frame.vertical_length_left
             + u_frame.vertical_length_right
-            - (1 if u_frame.angle_left == 90 else 0.5)
-            - (1 if u_frame.angle_right == 90 else 0.5)
+            - bend_deduction(
+                u_frame.angle_left, u_frame.thickness, u_frame.material, bend_table
+            )
+            - bend_deduction(
+                u_frame.angle_right, u_frame.thickness, u_frame.material, bend_table
+            )
         )
-        return Rectangle(u_frame.width, height, u_frame.thickness)
+        rectangle = Rectangle(u_frame.width, height, thickness=u_frame.thickness)
+        rectangle.frame = u_frame
+        return rectangle
 
-    def add_holes(self, holes: List[Hole]) -> None:
-        for hole in holes:
-            self.holes.append(hole)
-            self.holes_total_width += hole.width
+    @staticmethod
+    def from_profile(
+        profile: Profile, bend_table: Optional[BendTable] = None
+    ) -> Rectangle:
+        # Each distinct bend angle is deducted once per profile, however many
+        # bends share it
+        deductions = {
+            angle: bend_deduction(
+                angle, profile.thickness, profile.material, bend_table
+            )
+            for angle in set(profile.bends)
+        }
+        height = sum(profile.flanges) - sum(deductions[b] for b in profile.bends)
+        rectangle = Rectangle(profile.width, height, thickness=profile.thickness)
+        rectangle.frame = profile
+        return rectangle
+
+    def spec(self) -> RectangleSpec:
+        return RectangleSpec(
+            self.width,
+            self.height,
+            self.offset_from_side,
+            self.offset_from_bottom,
+            self.thickness,
+            FrozenHoleSet(self.holes),
+            self.perforation,
+            self.frame,
+        )
+
+    def add_holes(self, holes: Iterable[Hole], check: bool = True) -> None:
+        # All holes are appended and checked in one pass, on a violation
+        # nothing is added and HoleFitError lists every failed constraint
+        size = len(self.holes)
+        self.holes.extend(holes)
+        violations = self._fit_violations() if check else []
+        if violations:
+            self.holes.truncate(size)
+            raise HoleFitError(violations)
+
+    @property
+    def holes_total_width(self) -> float:
+        # Always follows self.holes, however the holes were added
+        return float(self.holes.width.sum())
+
+    def add_perforation(self, perforation: Perforation, check: bool = True) -> None:
+        # Perforated panel, the grid starts at offset_from_side/offset_from_bottom
+        previous = self.perforation
+        self.perforation = perforation
+        violations = self._fit_violations() if check else []
+        if violations:
+            self.perforation = previous
+            raise HoleFitError(violations)
+
+    def validate(self) -> List[Violation]:
+        # Every constraint violation of this rectangle, including the ones
+        # add_rectangle() would raise for
+        return validate_rectangles([self])
+
+    def _fit_violations(self) -> List[Violation]:
+        return [
+            violation for violation in self.validate() if violation.code != "hole_count"
+        ]
+
+    def perforation_start(
+        self, start_from_x: float = 0.0, start_from_y: float = 0.0
+    ) -> Tuple[float, float]:
+        # Center of the first perforation hole
+        assert self.perforation is not None
+        hole = self.perforation.hole
+        return (
+            start_from_x + self.offset_from_side + (hole.width / 2),
+            start_from_y + self.offset_from_bottom + (hole.height / 2),
+        )
+
+    def outline(
+        self, start_from_x: float = 0.0, start_from_y: float = 0.0
+    ) -> List[Vec3]:
+        return list(
+            translate(box(self.width, self.height), (start_from_x, start_from_y))
+        )
+
+    def hole_centers(
+        self, start_from_x: float = 0.0, start_from_y: float = 0.0
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # x and y arrays of the centers of the evenly spaced holes, computed in
+        # one vectorized step
+        if len(self.holes) <= 1:
+            raise ValueError("Need to have at least two holes")
+        space_minus_offsets_from_side = self.width - (2 * self.offset_from_side)
+        space_remaining = space_minus_offsets_from_side - self.holes_total_width
+        space_between_holes = space_remaining / (len(self.holes) - 1)
+
+        widths = self.holes.width
+        heights = self.holes.height
+        i = np.arange(len(self.holes))
+        hole_centers_x = (
+            start_from_x
+            + self.offset_from_side
+            + (i * widths + (widths / 2))
+            + (i * space_between_holes)
+        )
+        hole_centers_y = start_from_y + self.offset_from_bottom + (heights / 2)
+        return hole_centers_x, hole_centers_y
+
+    def hole_circles(
+        self, start_from_x: float = 0.0, start_from_y: float = 0.0
+    ) -> List[Tuple[float, float, float]]:
+        # (x, y, radius) of every circle to cut for the evenly spaced holes
+        # and the perforation
+        circles = []
+        if self.holes or self.perforation is None:
+            xs, ys = self.hole_centers(start_from_x, start_from_y)
+            for hole, x, y in zip(self.holes, xs.tolist(), ys.tolist()):
+                circles.extend(hole.circles(x, y))
+        if self.perforation is not None:
+            first_x, first_y = self.perforation_start(start_from_x, start_from_y)
+            xs, ys = self.perforation.centers(first_x, first_y)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                circles.extend(self.perforation.hole.circles(x, y))
+        return circles
+
+
+# Hatch boundary edge: arc center, radius, start and end angle (degrees, ccw)
+_Arc = Tuple[Tuple[float, float], float, float, float]
+
+
+def circle_boundaries(
+    circles: Sequence[Tuple[float, float, float]]
+) -> List[List[_Arc]]:
+    # Hatch boundaries for the (x, y, radius) circles of one hole, each a
+    # closed chain of arcs. The overlapping end circles of a short Slot become
+    # one boundary around their union, so a nested hatch doesn't fill the lens
+    # between them again.
+    if len(circles) == 2:
+        (ax, ay, radius), (bx, by, other_radius) = circles
+        distance = math.hypot(bx - ax, by - ay)
+        if radius == other_radius and distance == 0:
+            return [[((ax, ay), radius, 0.0, 360.0)]]
+        if radius == other_radius and distance < 2 * radius:
+            # Each circle keeps the arc between the two intersection points
+            # that faces away from the other circle
+            direction = math.degrees(math.atan2(by - ay, bx - ax))
+            half = math.degrees(math.acos(distance / (2 * radius)))
+            return [
+                [
+                    (
+                        (ax, ay),
+                        radius,
+                        (direction + half) % 360,
+                        (direction - half) % 360,
+                    ),
+                    (
+                        (bx, by),
+                        radius,
+                        (direction + 180 + half) % 360,
+                        (direction + 180 - half) % 360,
+                    ),
+                ]
+            ]
+    return [[((x, y), radius, 0.0, 360.0)] for x, y, radius in circles]
+
+
+def _overlapping_pairs(
+    circles: Sequence[Tuple[float, float, float]]
+) -> List[List[int]]:
+    # Indices of the circles grouped like the circles of one hole: pairs of
+    # overlapping circles with equal radius, every other circle on its own
+    by_radius: Dict[float, List[int]] = {}
+    for index, (_, _, radius) in enumerate(circles):
+        by_radius.setdefault(radius, []).append(index)
+    groups = []
+    paired: Set[int] = set()
+    for radius, indices in by_radius.items():
+        indices.sort(key=lambda index: circles[index][0])
+        for position, index in enumerate(indices):
+            if index in paired:
+                continue
+            x, y, _ = circles[index]
+            group = [index]
+            for other in indices[position + 1 :]:
+                other_x, other_y, _ = circles[other]
+                if other_x - x >= 2 * radius:
+                    break
+                distance = math.hypot(other_x - x, other_y - y)
+                if other not in paired and distance < 2 * radius:
+                    group.append(other)
+                    paired.add(other)
+                    break
+            paired.add(index)
+            groups.append(group)
+    return groups
+
+
+# "entity": one HATCH per outline and per hole
+# "rectangle": one HATCH per rectangle, outline as outer boundary and holes as islands
+# "none": cut-only, hatches can be added later with add_hatches()
+HATCH_MODES = ("entity", "rectangle", "none")
+# ASCII or binary DXF
+FORMATS = ("asc", "bin")
+
+
+def validate_rectangles(
+    rectangles: Iterable[Union[Rectangle, RectangleSpec]]
+) -> List[Violation]:
+    # Checks a whole batch in one vectorized pass over all holes of all
+    # rectangles. Violation.rectangle is the index in the batch.
+    rectangles = list(rectangles)
+
+    width = np.array([rectangle.width for rectangle in rectangles], dtype=float)
+    height = np.array([rectangle.height for rectangle in rectangles], dtype=float)
+    offset_from_side = np.array(
+        [rectangle.offset_from_side for rectangle in rectangles], dtype=float
+    )
+    offset_from_bottom = np.array(
+        [rectangle.offset_from_bottom for rectangle in rectangles], dtype=float
+    )
+    counts = np.array([len(rectangle.holes) for rectangle in rectangles], dtype=int)
+    starts = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(rectangles)), counts)
+    hole_index = np.arange(len(owner)) - starts[owner]
+    # Rectangle.holes and RectangleSpec.holes are both HoleSets
+    widths = np.concatenate(
+        [np.empty(0)] + [rectangle.holes.width for rectangle in rectangles]
+    )
+    heights = np.concatenate(
+        [np.empty(0)] + [rectangle.holes.height for rectangle in rectangles]
+    )
+
+    violations = []
+    # First hole per rectangle that no longer fits next to the ones before it
+    cumulative = np.concatenate(([0.0], np.cumsum(widths)))
+    running_width = cumulative[1:] - cumulative[starts[owner]]
+    too_wide = (2 * offset_from_side[owner]) + running_width >= width[owner]
+    rectangles_too_wide, first = np.unique(owner[too_wide], return_index=True)
+    for index, hole in zip(
+        rectangles_too_wide.tolist(), hole_index[too_wide][first].tolist()
+    ):
+        violations.append(
+            Violation(index, hole, "holes_width", "holes don't fit into the rectangle")
+        )
+
+    too_high = offset_from_bottom[owner] + heights > height[owner]
+    for index, hole in zip(owner[too_high].tolist(), hole_index[too_high].tolist()):
+        violations.append(Violation(index, hole, "hole_height", "hole too large"))
+
+    for index, rectangle in enumerate(rectangles):
+        perforation = rectangle.perforation
+        if counts[index] == 1 or (counts[index] == 0 and perforation is None):
+            violations.append(
+                Violation(index, None, "hole_count", "Need to have at least two holes")
+            )
+        if perforation is None:
+            continue
+        if counts[index]:
+            # Both layouts start at the offsets corner and would overlap
+            violations.append(
+                Violation(
+                    index,
+                    None,
+                    "holes_and_perforation",
+                    "rectangle can't have both holes and a perforation",
+                )
+            )
+        if width[index] <= (2 * offset_from_side[index]) + perforation.width:
+            violations.append(
+                Violation(
+                    index,
+                    None,
+                    "perforation_width",
+                    "perforation doesn't fit into the rectangle",
+                )
+            )
+        if height[index] < offset_from_bottom[index] + perforation.height:
+            violations.append(
+                Violation(index, None, "perforation_height", "perforation too large")
+            )
+
+    # Stable sort keeps the order of the checks within a rectangle
+    violations.sort(key=lambda violation: violation.rectangle)
+    return violations
+
+
+# Root dictionary XRECORD with the outline boxes of a common_line document
+_COMMON_LINE_BOXES = "DXF_CHEDDAR_OUTLINES"
+
+
+def common_line_segments(
+    boxes: Sequence[Tuple[float, float, float, float]], decimals: int = 6
+) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+    # Cut segments for the outlines of (x0, y0, x1, y1) boxes: edges on the
+    # same horizontal or vertical line (coordinates rounded to `decimals`)
+    # that overlap or touch are merged, so every shared edge is cut once
+    if not len(boxes):
+        return []
+    x0, y0, x1, y1 = np.round(np.asarray(boxes, dtype=float), decimals).T
+    segments = []
+    # (line coordinate, start, end) per edge, horizontal edges then vertical
+    for vertical, line, start, end in (
+        (False, np.concatenate([y0, y1]), np.tile(x0, 2), np.tile(x1, 2)),
+        (True, np.concatenate([x0, x1]), np.tile(y0, 2), np.tile(y1, 2)),
+    ):
+        order = np.lexsort((start, line))
+        current: Optional[List[float]] = None
+        for c, a, b in zip(
+            line[order].tolist(), start[order].tolist(), end[order].tolist()
+        ):
+            if current is not None and c == current[0] and a <= current[2]:
+                current[2] = max(current[2], b)
+                continue
+            if current is not None:
+                segments.append((vertical, *current))
+            current = [c, a, b]
+        segments.append((vertical, *current))
+    return [
+        ((c, a), (c, b)) if vertical else ((a, c), (b, c))
+        for vertical, c, a, b in segments
+    ]
+
+
+_Point = Tuple[float, float]
 
-            assert (
-                self.width > (2 * self.offset_from_side) + self.holes_total_width
-            ), "holes don't fit into the rectangle"
-            assert (
-                self.height >= self.offset_from_bottom + hole.height
-            ), "hole too large"
+
+def common_line_paths(
+    boxes: Sequence[Tuple[float, float, float, float]], decimals: int = 6
+) -> List[Tuple[List[_Point], bool]]:
+    # (points, closed) polylines cutting the common_line_segments() once
+    # each: the segments are split at the box corners and chained into as few
+    # paths as a greedy walk finds, starting from odd vertices. A box that
+    # touches nothing stays one closed rectangle.
+    corners: Dict[Tuple[bool, float], List[float]] = {}
+    for x0, y0, x1, y1 in np.round(np.asarray(boxes, dtype=float), decimals).tolist():
+        for x, y in ((x0, y0), (x1, y0), (x1, y1), (x0, y1)):
+            corners.setdefault((False, y), []).append(x)
+            corners.setdefault((True, x), []).append(y)
+    for values in corners.values():
+        values.sort()
+
+    edges: List[Tuple[_Point, _Point]] = []
+    for (ax, ay), (bx, by) in common_line_segments(boxes, decimals):
+        vertical = ax == bx
+        line, low, high = (ax, ay, by) if vertical else (ay, ax, bx)
+        values = corners.get((vertical, line), [])
+        stops = [low]
+        for value in values[bisect_right(values, low) : bisect_left(values, high)]:
+            if value != stops[-1]:
+                stops.append(value)
+        stops.append(high)
+        for a, b in zip(stops, stops[1:]):
+            edges.append(((line, a), (line, b)) if vertical else ((a, line), (b, line)))
+
+    adjacent: Dict[_Point, List[int]] = {}
+    for index, (p, q) in enumerate(edges):
+        adjacent.setdefault(p, []).append(index)
+        adjacent.setdefault(q, []).append(index)
+    used = [False] * len(edges)
+    starts = sorted(adjacent, key=lambda point: (len(adjacent[point]) % 2 == 0, point))
+    paths = []
+    for start in starts:
+        while any(not used[index] for index in adjacent[start]):
+            points = [start]
+            while True:
+                index = next(
+                    (i for i in adjacent[points[-1]] if not used[i]), None
+                )
+                if index is None:
+                    break
+                used[index] = True
+                p, q = edges[index]
+                points.append(q if p == points[-1] else p)
+            closed = len(points) > 3 and points[0] == points[-1]
+            if closed:
+                points.pop()
+            paths.append((_drop_collinear(points, closed), closed))
+    return paths
+
+
+def _drop_collinear(points: List[_Point], closed: bool) -> List[_Point]:
+    # Axis-aligned path without the points in the middle of straight runs
+    result = []
+    count = len(points)
+    for i, (x, y) in enumerate(points):
+        if not closed and (i == 0 or i == count - 1):
+            result.append((x, y))
+            continue
+        (px, py), (nx, ny) = points[i - 1], points[(i + 1) % count]
+        if not ((px == x == nx) or (py == y == ny)):
+            result.append((x, y))
+    return result
 
 
 class DXF:
-    def __init__(self) -> None:
-        self.doc = ezdxf.new()
-        self.doc.layers.new("FORMS", dxfattribs={"color": 1})
-        self.doc.layers.new("HATCHES")
+    # use_blocks: each unique hole geometry is defined once as a BLOCK (with its
+    # hatch in "entity" mode) and every hole is an INSERT of that block.
+    # common_line: outlines are cut as chained polylines, with coincident or
+    # touching collinear edges of neighbouring rectangles merged into one
+    # cut. The outline boxes are kept in the file for deferred hatching.
+    def __init__(
+        self,
+        hatch_mode: str = "entity",
+        doc: Optional[Drawing] = None,
+        use_blocks: bool = False,
+        common_line: bool = False,
+    ) -> None:
+        if hatch_mode not in HATCH_MODES:
+            raise ValueError(f"hatch_mode must be one of {HATCH_MODES}")
+        if doc is None:
+            doc = ezdxf.new()
+        self.doc = doc
+        if "FORMS" not in self.doc.layers:
+            self.doc.layers.new("FORMS", dxfattribs={"color": 1})
+        if "HATCHES" not in self.doc.layers:
+            self.doc.layers.new("HATCHES")
         self.msp = self.doc.modelspace()
         self.attribs = {"layer": "FORMS"}
+        self.hatch_attribs = {"layer": "HATCHES"}
+        self.hatch_color = 2
+        self.hatch_mode = hatch_mode
+        self.use_blocks = use_blocks
+        self.common_line = common_line
+        self.doc.set_modelspace_vport(15, (4, 4))
+
+        # Handles of FORMS entities that already have a hatch, so repeated
+        # saves only hatch what was added since
+        self._hatched: Set[str] = set()
+        # Outline boxes and hatches for hatch_mode="rectangle" island lookup
+        self._outlines: List[Tuple[BoundingBox2d, Hatch]] = []
+        # Block name per Hole.key() of the current part; reset() deletes the
+        # blocks so no file carries blocks of earlier parts
+        self._hole_blocks: Dict[Tuple, str] = {}
+        # common_line: outline boxes (x0, y0, x1, y1) and the handles of the
+        # polylines last generated from them, regenerated on save when dirty.
+        # Boxes of a loaded file that have no hatch yet wait for hatch_forms().
+        self._boxes: List[Tuple[float, float, float, float]] = []
+        self._unhatched_boxes: List[Tuple[float, float, float, float]] = []
+        self._common_lines: List[str] = []
+        self._common_lines_dirty = False
+
+    def reset(self) -> None:
+        # Empty the modelspace but keep the document with its layers, header
+        # and viewport, so one DXF can be reused for many parts in a batch
+        # instead of paying for a new document per part
+        self.msp.delete_all_entities()
+        for block in [b for b in self.doc.blocks if b.name.startswith("HOLE_")]:
+            self.doc.blocks.delete_block(block.name, safe=False)
+        self._hole_blocks.clear()
+        self._hatched.clear()
+        self._outlines.clear()
+        self._boxes.clear()
+        self._unhatched_boxes.clear()
+        self._common_lines.clear()
+        # Rewrites the stored boxes of a common_line document on next save
+        self._common_lines_dirty = self.common_line
+        # Drop the destroyed entities from the database, or a long-lived
+        # document grows with every part
+        self.doc.entitydb.purge()
+
+    @staticmethod
+    def load(filename: str, hatch_mode: str = "entity") -> DXF:
+        doc = ezdxf.readfile(DIR / f"{filename}.dxf")
+        if doc.dxfversion >= const.DXF2000:
+            dxf = DXF(hatch_mode, doc=doc)
+            hatched = len(dxf.msp.query('HATCH[layer=="HATCHES"]')) > 0
+            boxes = doc.rootdict.get(_COMMON_LINE_BOXES)
+            if boxes is not None:
+                # Written with common_line: the FORMS polylines are the merged
+                # cuts, the outlines to hatch are the stored boxes
+                values = [tag.value for tag in boxes.tags if tag.code == 40]
+                dxf.common_line = True
+                dxf._boxes = [
+                    tuple(values[i : i + 4]) for i in range(0, len(values), 4)
+                ]
+                dxf._common_lines = [
+                    polyline.dxf.handle
+                    for polyline in dxf.msp.query('LWPOLYLINE[layer=="FORMS"]')
+                ]
+                dxf._hatched.update(dxf._common_lines)
+                if not hatched:
+                    dxf._unhatched_boxes = list(dxf._boxes)
+            # A file that already has hatches counts as hatched, so hatching
+            # it again doesn't duplicate them
+            if hatched:
+                dxf._hatched.update(
+                    entity.dxf.handle
+                    for entity in dxf.msp.query('*[layer=="FORMS"]')
+                )
+            return dxf
+
+        # R12 (e.g. written by DXFStream) has no HATCH, redraw the FORMS
+        # entities into a new document
+        dxf = DXF(hatch_mode)
+        forms = doc.modelspace()
+        for polyline in forms.query('POLYLINE[layer=="FORMS"]'):
+            dxf.msp.add_lwpolyline(
+                [(p.x, p.y) for p in polyline.points()],
+                close=polyline.is_closed,
+                dxfattribs=dxf.attribs,
+            )
+        for circle in forms.query('CIRCLE[layer=="FORMS"]'):
+            dxf.msp.add_circle(
+                circle.dxf.center, radius=circle.dxf.radius, dxfattribs=dxf.attribs
+            )
+        return dxf
+
+    # Hatches are built as each entity is added, so save() only has to serialize.
+    # Boundaries come straight from the known geometry (true arcs, no flattening).
+    # Passing an existing hatch adds the boundary to it as an island.
+    def _new_hatch(self, layout: Optional[BaseLayout] = None) -> Hatch:
+        if layout is None:
+            layout = self.msp
+        hatch = layout.add_hatch(
+            color=self.hatch_color, dxfattribs=self.hatch_attribs
+        )
+        hatch.dxf.hatch_style = const.HATCH_STYLE_NESTED
+        return hatch
+
+    def _hatch_polyline(
+        self, points: List[Vec3], hatch: Optional[Hatch] = None
+    ) -> Optional[Hatch]:
+        if self.hatch_mode == "none":
+            return None
+        flags = const.BOUNDARY_PATH_DEFAULT
+        if hatch is None:
+            hatch = self._new_hatch()
+            flags = const.BOUNDARY_PATH_EXTERNAL
+        hatch.paths.add_polyline_path(
+            [(p.x, p.y) for p in points], is_closed=True, flags=flags
+        )
+        return hatch
+
+    def _hatch_arcs(
+        self,
+        arcs: List[_Arc],
+        hatch: Optional[Hatch] = None,
+        layout: Optional[BaseLayout] = None,
+    ) -> Optional[Hatch]:
+        if self.hatch_mode == "none":
+            return None
+        flags = const.BOUNDARY_PATH_DEFAULT
+        if hatch is None:
+            hatch = self._new_hatch(layout)
+            flags = const.BOUNDARY_PATH_EXTERNAL
+        edge_path = hatch.paths.add_edge_path(flags=flags)
+        for center, radius, start_angle, end_angle in arcs:
+            edge_path.add_arc(center, radius, start_angle, end_angle)
+        return hatch
+
+    def _hatch_circles(
+        self,
+        circles: List[Tuple[float, float, float]],
+        hatch: Optional[Hatch] = None,
+        layout: Optional[BaseLayout] = None,
+    ) -> None:
+        # The circles of one hole, see circle_boundaries()
+        for arcs in circle_boundaries(circles):
+            self._hatch_arcs(arcs, hatch, layout)
+
+    def _add_outline(self, points: List[Vec3]) -> Optional[Hatch]:
+        if self.common_line:
+            # The cut is left to _update_common_lines(), the hatch still
+            # follows the rectangle itself
+            bbox = BoundingBox2d(points)
+            low, high = bbox.extmin, bbox.extmax
+            self._boxes.append((low.x, low.y, high.x, high.y))
+            self._common_lines_dirty = True
+        else:
+            outline = self.msp.add_lwpolyline(
+                points, close=True, dxfattribs=self.attribs
+            )
+        hatch = self._hatch_polyline(points)
+        if hatch is not None:
+            if not self.common_line:
+                self._hatched.add(outline.dxf.handle)
+            if self.hatch_mode == "rectangle":
+                self._outlines.append((BoundingBox2d(points), hatch))
+        return hatch
+
+    def _update_common_lines(self) -> None:
+        # Replace the polylines of the previous save, so saving repeatedly
+        # never duplicates cuts, and store the boxes they were made from
+        if not self._common_lines_dirty:
+            return
+        for handle in self._common_lines:
+            entity = self.doc.entitydb.get(handle)
+            if entity is not None and entity.is_alive:
+                self.msp.delete_entity(entity)
+        self._common_lines = [
+            self.msp.add_lwpolyline(
+                points, close=closed, dxfattribs=self.attribs
+            ).dxf.handle
+            for points, closed in common_line_paths(self._boxes)
+        ]
+        # Cuts only, the hatches come from the boxes
+        self._hatched.update(self._common_lines)
+
+        xrecord = self.doc.rootdict.get(_COMMON_LINE_BOXES)
+        if xrecord is None:
+            xrecord = self.doc.rootdict.add_xrecord(_COMMON_LINE_BOXES)
+        xrecord.reset([(40, value) for box in self._boxes for value in box])
+        self._common_lines_dirty = False
+
+    def _add_circles(
+        self, circles: List[Tuple[float, float, float]], hatch: Optional[Hatch] = None
+    ) -> None:
+        # Cut the circles of one hole and hatch them as one hole
+        for x, y, radius in circles:
+            circle = self.msp.add_circle((x, y), radius=radius, dxfattribs=self.attribs)
+            if self.hatch_mode != "none":
+                self._hatched.add(circle.dxf.handle)
+        self._hatch_circles(circles, hatch)
+
+    def _hole_block(self, hole: Hole) -> str:
+        key = hole.key()
+        if key not in self._hole_blocks:
+            index = len(self._hole_blocks) + 1
+            while f"HOLE_{index}" in self.doc.blocks:
+                index += 1
+            block = self.doc.blocks.new(f"HOLE_{index}")
+            circles = hole.circles(0.0, 0.0)
+            for x, y, radius in circles:
+                block.add_circle((x, y), radius=radius, dxfattribs=self.attribs)
+            if self.hatch_mode == "entity":
+                self._hatch_circles(circles, layout=block)
+            self._hole_blocks[key] = block.name
+        return self._hole_blocks[key]
 
     def add_rectangle(
         self, rectangle: Rectangle, start_from_x: float = 0.0, start_from_y: float = 0.0
     ) -> None:
         # Rectangle with evenly spaced holes
-        rect_coordinates = translate(
-            box(rectangle.width, rectangle.height), (start_from_x, start_from_y)
+        outline_hatch = self._add_outline(
+            rectangle.outline(start_from_x, start_from_y)
         )
-        self.msp.add_lwpolyline(rect_coordinates, close=True, dxfattribs=self.attribs)
+        hole_hatch = outline_hatch if self.hatch_mode == "rectangle" else None
+        if rectangle.holes or rectangle.perforation is None:
+            self._add_holes(rectangle, start_from_x, start_from_y, hole_hatch)
+        if rectangle.perforation is not None:
+            self._add_perforation(rectangle, start_from_x, start_from_y, hole_hatch)
+
+    def _add_holes(
+        self,
+        rectangle: Rectangle,
+        start_from_x: float,
+        start_from_y: float,
+        hole_hatch: Optional[Hatch],
+    ) -> None:
+        xs, ys = rectangle.hole_centers(start_from_x, start_from_y)
+        for hole, x, y in zip(rectangle.holes, xs.tolist(), ys.tolist()):
+            if not self.use_blocks:
+                self._add_circles(hole.circles(x, y), hole_hatch)
+                continue
+            insert = self.msp.add_blockref(
+                self._hole_block(hole), (x, y), dxfattribs=self.attribs
+            )
+            # Hatched in the block ("entity") or as islands ("rectangle")
+            if self.hatch_mode != "none":
+                self._hatched.add(insert.dxf.handle)
+            if hole_hatch is not None:
+                self._hatch_circles(hole.circles(x, y), hole_hatch)
+
+    def _add_perforation(
+        self,
+        rectangle: Rectangle,
+        start_from_x: float,
+        start_from_y: float,
+        hole_hatch: Optional[Hatch],
+    ) -> None:
+        # One block for the hole and one MINSERT per grid, so the entity count
+        # doesn't depend on the number of holes
+        perforation = rectangle.perforation
+        assert perforation is not None
+        name = self._hole_block(perforation.hole)
+        first_x, first_y = rectangle.perforation_start(start_from_x, start_from_y)
+        for x, y, rows, row_spacing in perforation.grids(first_x, first_y):
+            grid = self.msp.add_blockref(
+                name,
+                (x, y),
+                dxfattribs={
+                    **self.attribs,
+                    "row_count": rows,
+                    "row_spacing": row_spacing,
+                    "column_count": perforation.columns,
+                    "column_spacing": perforation.pitch_x,
+                },
+            )
+            if self.hatch_mode != "none":
+                self._hatched.add(grid.dxf.handle)
+        if hole_hatch is not None:
+            xs, ys = perforation.centers(first_x, first_y)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                self._hatch_circles(perforation.hole.circles(x, y), hole_hatch)
+
+    def hatch_forms(self) -> None:
+        # Hatch FORMS entities that have no hatch yet, e.g. entities added to
+        # msp directly or a loaded cut-only file. Holes belong to the outline
+        # whose box contains them.
+        if self.hatch_mode == "none":
+            return
+        for x0, y0, x1, y1 in self._unhatched_boxes:
+            points = [Vec3(x0, y0), Vec3(x1, y0), Vec3(x1, y1), Vec3(x0, y1)]
+            hatch = self._hatch_polyline(points)
+            if self.hatch_mode == "rectangle":
+                self._outlines.append((BoundingBox2d(points), hatch))
+        self._unhatched_boxes.clear()
+        for polyline in self.msp.query('LWPOLYLINE[layer=="FORMS"]'):
+            if polyline.dxf.handle in self._hatched:
+                continue
+            points = [Vec3(x, y) for x, y in polyline.get_points("xy")]
+            hatch = self._hatch_polyline(points)
+            self._hatched.add(polyline.dxf.handle)
+            if self.hatch_mode == "rectangle":
+                self._outlines.append((BoundingBox2d(points), hatch))
+        # Overlapping circle pairs are taken as the two ends of a slot
+        entities = [
+            circle
+            for circle in self.msp.query('CIRCLE[layer=="FORMS"]')
+            if circle.dxf.handle not in self._hatched
+        ]
+        circles = [
+            (circle.dxf.center.x, circle.dxf.center.y, circle.dxf.radius)
+            for circle in entities
+        ]
+        for group in _overlapping_pairs(circles):
+            hole = [circles[index] for index in group]
+            self._hatch_circles(hole, self._outline_hatch(hole[0][:2]))
+            self._hatched.update(entities[index].dxf.handle for index in group)
+        # Hole blocks placed by INSERT and perforation grids by MINSERT
+        for insert in self.msp.query('INSERT[layer=="FORMS"]'):
+            if insert.dxf.handle in self._hatched:
+                continue
+            block = self.doc.blocks.get(insert.dxf.name)
+            if block is None:
+                continue
+            circles = block.query("CIRCLE")
+            if self.hatch_mode == "entity":
+                # The hatch goes into the block, shared by all its references
+                if not len(block.query("HATCH")):
+                    self._hatch_circles(
+                        [
+                            (c.dxf.center.x, c.dxf.center.y, c.dxf.radius)
+                            for c in circles
+                        ],
+                        layout=block,
+                    )
+            else:
+                for virtual in insert.multi_insert():
+                    matrix = virtual.matrix44()
+                    scale = abs(virtual.dxf.xscale)
+                    placed = []
+                    for circle in circles:
+                        center = matrix.transform(circle.dxf.center)
+                        placed.append((center.x, center.y, circle.dxf.radius * scale))
+                    if placed:
+                        self._hatch_circles(
+                            placed, self._outline_hatch(placed[0][:2])
+                        )
+            self._hatched.add(insert.dxf.handle)
 
-        space_minus_offsets_from_side = rectangle.width - (
-            2 * rectangle.offset_from_side
+    def _outline_hatch(self, center: Tuple[float, float]) -> Optional[Hatch]:
+        # hatch_mode="rectangle": the hatch of the outline around a hole
+        if self.hatch_mode == "rectangle":
+            for bbox, outline_hatch in self._outlines:
+                if bbox.inside(center):
+                    return outline_hatch
+        return None
+
+    def save(self, filename: str, fmt: str = "asc") -> None:
+        # add_rectangle() hatches as it goes, this only picks up FORMS
+        # entities added by other means since the last save.
+        # fmt="bin" writes binary DXF, smaller and faster to write and load.
+        self._update_common_lines()
+        self.hatch_forms()
+        self.doc.saveas(DIR / f"{filename}.dxf", fmt=fmt)
+
+    def write(self, stream: Union[TextIO, BinaryIO], fmt: str = "asc") -> None:
+        # Like save() but into a text (fmt="asc") or binary (fmt="bin") stream
+        self._update_common_lines()
+        self.hatch_forms()
+        self.doc.write(stream, fmt=fmt)
+
+    def to_bytes(self, fmt: str = "asc") -> bytes:
+        if fmt == "bin":
+            binary_stream = io.BytesIO()
+            self.write(binary_stream, fmt=fmt)
+            return binary_stream.getvalue()
+        text_stream = io.StringIO()
+        self.write(text_stream, fmt=fmt)
+        return text_stream.getvalue().encode(
+            self.doc.output_encoding, errors="dxfreplace"
         )
-        space_remaining = space_minus_offsets_from_side - rectangle.holes_total_width
-        if len(rectangle.holes) <= 1:
-            raise ValueError("Need to have at least two holes")
-        space_between_holes = space_remaining / (len(rectangle.holes) - 1)
 
-        for i, hole in enumerate(rectangle.holes):
-            hole_center_x = (
-                start_from_x
-                + rectangle.offset_from_side
-                + (i * hole.width + (hole.width / 2))
-                + (i * space_between_holes)
+
+class DXFStream:
+    # Cut-only backend that writes each entity straight to a file or stream
+    # as DXF R12, without building an ezdxf document, so memory stays constant
+    # however many parts are written. R12 has no HATCH or LWPOLYLINE entity:
+    # outlines are written as closed 2D POLYLINEs and nothing is hatched, use
+    # add_hatches() on the file if a visual proof is needed.
+    def __init__(self, writer: R12FastStreamWriter) -> None:
+        self.writer = writer
+        self.layer = "FORMS"
+        self.color = 1
+
+    @staticmethod
+    @contextmanager
+    def open(
+        stream: Union[str, Path, TextIO, BinaryIO], fmt: str = "asc"
+    ) -> Iterator[DXFStream]:
+        # fmt="bin" needs a binary stream
+        with r12writer(stream, fmt=fmt) as writer:
+            yield DXFStream(writer)
+
+    def add_rectangle(
+        self, rectangle: Rectangle, start_from_x: float = 0.0, start_from_y: float = 0.0
+    ) -> None:
+        self.writer.add_polyline_2d(
+            [(p.x, p.y) for p in rectangle.outline(start_from_x, start_from_y)],
+            closed=True,
+            layer=self.layer,
+            color=self.color,
+        )
+        for x, y, radius in rectangle.hole_circles(start_from_x, start_from_y):
+            self.writer.add_circle((x, y), radius, layer=self.layer, color=self.color)
+
+
+def _canonical(value: object) -> object:
+    # Value with numbers as floats and dataclasses as (name, init fields),
+    # so equal specs always give the same repr
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, (tuple, list)):
+        return tuple(_canonical(item) for item in value)
+    if isinstance(value, HoleSet):
+        return ("HoleSet", hashlib.sha256(value.tobytes()).hexdigest())
+    if is_dataclass(value):
+        return (type(value).__name__,) + tuple(
+            _canonical(getattr(value, f.name)) for f in fields(value) if f.init
+        )
+    raise TypeError(f"can't canonicalize {type(value).__name__}")
+
+
+class PartCache:
+    # Content addressed store of written DXF files, keyed by a hash of the
+    # part spec (including the frame it was unfolded from) and the output
+    # options. Keeps at most max_entries files, evicting the least recently
+    # used, and survives restarts through the file modification times.
+    def __init__(self, directory: Union[str, Path], max_entries: int = 1000) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Path] = OrderedDict(
+            (path.stem, path)
+            for path in sorted(
+                self.directory.glob("*.dxf"), key=lambda path: path.stat().st_mtime
+            )
+        )
+
+    @staticmethod
+    def key(
+        spec: RectangleSpec,
+        hatch_mode: str = "entity",
+        use_blocks: bool = False,
+        fmt: str = "asc",
+    ) -> str:
+        canonical = _canonical((spec, hatch_mode, use_blocks, fmt))
+        return hashlib.sha256(repr(canonical).encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self._entries.get(key)
+        if path is None:
+            return None
+        self._entries.move_to_end(key)
+        os.utime(path)
+        return path
+
+    def put(self, key: str, data: bytes) -> Path:
+        path = self.directory / f"{key}.dxf"
+        temporary = path.with_suffix(".tmp")
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+        self._entries[key] = path
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            evicted.unlink(missing_ok=True)
+        return path
+
+    def save(
+        self,
+        spec: RectangleSpec,
+        filename: str,
+        hatch_mode: str = "entity",
+        use_blocks: bool = False,
+        fmt: str = "asc",
+    ) -> bool:
+        # Like DXF.save() for a single part, a repeated spec is only a copy
+        # of the cached file. Returns True on a cache hit.
+        key = self.key(spec, hatch_mode, use_blocks, fmt)
+        cached = self.get(key)
+        if cached is None:
+            dxf = DXF(hatch_mode, use_blocks=use_blocks)
+            dxf.add_rectangle(spec.to_rectangle())
+            cached = self.put(key, dxf.to_bytes(fmt))
+            hit = False
+        else:
+            hit = True
+        shutil.copyfile(cached, DIR / f"{filename}.dxf")
+        return hit
+
+
+@dataclass(frozen=True, slots=True)
+class ManifestEntry:
+    # One generated file of a batch and the parts it stands for
+    filename: str
+    quantity: int
+    names: Tuple[str, ...]
+    spec: RectangleSpec
+
+
+def dedupe_parts(
+    parts: Iterable[Tuple[str, Union[Rectangle, RectangleSpec]]]
+) -> Dict[RectangleSpec, List[str]]:
+    # Names of all parts per unique spec, in order of first appearance
+    groups: Dict[RectangleSpec, List[str]] = {}
+    for name, part in parts:
+        spec = part.spec() if isinstance(part, Rectangle) else part
+        groups.setdefault(spec, []).append(name)
+    return groups
+
+
+def write_manifest(filename: Union[str, Path], manifest: List[ManifestEntry]) -> None:
+    with open(filename, "w", newline="") as stream:
+        writer = csv.writer(stream)
+        writer.writerow(["file", "quantity", "parts"])
+        for entry in manifest:
+            writer.writerow([entry.filename, entry.quantity, ";".join(entry.names)])
+
+
+# Document of a pool worker process, prepared once by _init_worker()
+_worker_dxf: Optional[DXF] = None
+
+
+def _init_worker(hatch_mode: str, use_blocks: bool) -> None:
+    # Runs once per process: ezdxf is imported along with this module and the
+    # document is ready before the first job arrives
+    global _worker_dxf
+    _worker_dxf = DXF(hatch_mode, use_blocks=use_blocks)
+
+
+def _render_part(spec: RectangleSpec, fmt: str) -> bytes:
+    assert _worker_dxf is not None
+    _worker_dxf.reset()
+    _worker_dxf.add_rectangle(spec.to_rectangle())
+    return _worker_dxf.to_bytes(fmt)
+
+
+def _save_parts(dxf: DXF, parts: List[Tuple[str, RectangleSpec]], fmt: str) -> int:
+    for filename, spec in parts:
+        dxf.reset()
+        dxf.add_rectangle(spec.to_rectangle())
+        dxf.save(filename, fmt=fmt)
+    return len(parts)
+
+
+def _save_chunk(parts: List[Tuple[str, RectangleSpec]], fmt: str) -> int:
+    assert _worker_dxf is not None
+    return _save_parts(_worker_dxf, parts, fmt)
+
+
+def save_parallel(
+    parts: Sequence[Tuple[str, RectangleSpec]],
+    workers: Optional[int] = None,
+    hatch_mode: str = "entity",
+    use_blocks: bool = False,
+    fmt: str = "asc",
+    chunk_size: int = 0,
+) -> int:
+    # Saves every (filename, spec) like DXF.save() on a pool of warm worker
+    # processes (default: one per core). Jobs are sent in chunks, by default
+    # about four per worker, so IPC stays small next to the work. Filenames
+    # should be absolute, DIR is only read at import in spawned workers.
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(parts) <= 1:
+        return _save_parts(DXF(hatch_mode, use_blocks=use_blocks), list(parts), fmt)
+
+    chunk_size = chunk_size or max(1, math.ceil(len(parts) / (workers * 4)))
+    chunks = [
+        list(parts[i : i + chunk_size]) for i in range(0, len(parts), chunk_size)
+    ]
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(hatch_mode, use_blocks)
+    ) as executor:
+        return sum(executor.map(partial(_save_chunk, fmt=fmt), chunks))
+
+
+class WorkerPool:
+    # Long lived pool for on-demand jobs. All workers start, import ezdxf and
+    # prepare their document in the constructor, so a job only pays for its
+    # own part and the transfer of its spec and file. Jobs wait in the pool's
+    # task queue.
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        hatch_mode: str = "entity",
+        use_blocks: bool = False,
+    ) -> None:
+        self._pool = multiprocessing.Pool(
+            workers, initializer=_init_worker, initargs=(hatch_mode, use_blocks)
+        )
+
+    def __enter__(self) -> WorkerPool:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def render(self, spec: RectangleSpec, fmt: str = "asc") -> AsyncResult:
+        # File content of one part, get() on the result returns the bytes
+        return self._pool.apply_async(_render_part, (spec, fmt))
+
+    def save(
+        self, parts: Sequence[Tuple[str, RectangleSpec]], fmt: str = "asc"
+    ) -> AsyncResult:
+        # Saves (filename, spec) parts as one job, get() returns the count
+        return self._pool.apply_async(_save_chunk, (list(parts), fmt))
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+
+
+def generate_batch(
+    parts: Iterable[Tuple[str, Union[Rectangle, RectangleSpec]]],
+    output_dir: Union[str, Path] = ".",
+    hatch_mode: str = "entity",
+    use_blocks: bool = False,
+    fmt: str = "asc",
+    cache: Optional[PartCache] = None,
+    workers: int = 1,
+) -> List[ManifestEntry]:
+    # Generates each unique part once, named after its first occurrence, and
+    # writes manifest.csv with the quantity and part names per file. With
+    # workers > 1 the parts missing from the cache go through save_parallel().
+    output_dir = (DIR / output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    used: Set[str] = set()
+    missing: List[Tuple[str, RectangleSpec]] = []
+    keys: List[str] = []
+    for spec, names in dedupe_parts(parts).items():
+        stem = names[0]
+        suffix = 1
+        while stem.lower() in used:
+            suffix += 1
+            stem = f"{names[0]}_{suffix}"
+        used.add(stem.lower())
+
+        filename = str(output_dir / stem)
+        cached = None
+        if cache is not None:
+            key = cache.key(spec, hatch_mode, use_blocks, fmt)
+            cached = cache.get(key)
+        if cached is None:
+            missing.append((filename, spec))
+            if cache is not None:
+                keys.append(key)
+        else:
+            shutil.copyfile(cached, f"{filename}.dxf")
+        manifest.append(ManifestEntry(f"{stem}.dxf", len(names), tuple(names), spec))
+
+    save_parallel(missing, workers, hatch_mode, use_blocks, fmt)
+    if cache is not None:
+        for (filename, _), key in zip(missing, keys):
+            cache.put(key, Path(f"{filename}.dxf").read_bytes())
+    write_manifest(output_dir / "manifest.csv", manifest)
+    return manifest
+
+
+# Tolerance for comparing coordinates while nesting
+_NEST_EPSILON = 1e-9
+
+
+@dataclass(frozen=True, slots=True)
+class Placement:
+    # Lower left corner of part `index` (into the nested list) on its sheet
+    index: int
+    x: float
+    y: float
+
+
+class _Skyline:
+    # Bottom-left skyline packing of one sheet. The skyline is a list of
+    # [x, y, width] segments covering the sheet from left to right.
+    __slots__ = ("width", "height", "segments", "free_area")
+
+    def __init__(self, width: float, height: float) -> None:
+        self.width = width
+        self.height = height
+        self.segments: List[List[float]] = [[0.0, 0.0, width]]
+        self.free_area = width * height
+
+    def find(self, width: float, height: float) -> Optional[Tuple[float, float, int]]:
+        # (x, y, segment) of the lowest, then leftmost, position for the part
+        best: Optional[Tuple[float, float, int]] = None
+        segments = self.segments
+        for i, (x, _, _) in enumerate(segments):
+            if x + width > self.width + _NEST_EPSILON:
+                break
+            y = 0.0
+            j = i
+            while j < len(segments) and segments[j][0] < x + width - _NEST_EPSILON:
+                y = max(y, segments[j][1])
+                j += 1
+            if y + height > self.height + _NEST_EPSILON:
+                continue
+            if best is None or y < best[1] - _NEST_EPSILON:
+                best = (x, y, i)
+        return best
+
+    def place(self, x: float, y: float, i: int, width: float, height: float) -> None:
+        segments = self.segments
+        right = x + width
+        j = i
+        while j < len(segments) and segments[j][0] < right - _NEST_EPSILON:
+            j += 1
+        new = [[x, y + height, width]]
+        last_x, last_y, last_width = segments[j - 1]
+        if last_x + last_width > right + _NEST_EPSILON:
+            new.append([right, last_y, last_x + last_width - right])
+        segments[i:j] = new
+
+        # Merge neighbours of equal height around the new segment
+        k = max(i - 1, 0)
+        while k < min(i + 2, len(segments) - 1):
+            if abs(segments[k][1] - segments[k + 1][1]) <= _NEST_EPSILON:
+                segments[k][2] += segments[k + 1][2]
+                del segments[k + 1]
+            else:
+                k += 1
+        self.free_area -= width * height
+
+
+def nest(
+    rectangles: Sequence[Union[Rectangle, RectangleSpec]],
+    sheet_width: float,
+    sheet_height: float,
+    spacing: float = 0.0,
+    margin: float = 0.0,
+) -> List[List[Placement]]:
+    # Placements per sheet for packing the parts, unrotated, onto as few
+    # sheet_width x sheet_height sheets as the skyline heuristic finds: parts
+    # go tallest first to the lowest, then leftmost, spot on the first sheet
+    # with room. Parts keep `spacing` between them and `margin` to the edges.
+    usable_width = sheet_width - 2 * margin + spacing
+    usable_height = sheet_height - 2 * margin + spacing
+    order = sorted(
+        range(len(rectangles)),
+        key=lambda i: (-rectangles[i].height, -rectangles[i].width),
+    )
+    sheets: List[_Skyline] = []
+    placements: List[List[Placement]] = []
+    for index in order:
+        rectangle = rectangles[index]
+        width = rectangle.width + spacing
+        height = rectangle.height + spacing
+        if (
+            width > usable_width + _NEST_EPSILON
+            or height > usable_height + _NEST_EPSILON
+        ):
+            raise ValueError(
+                f"part {index} ({rectangle.width} x {rectangle.height}) doesn't"
+                f" fit on a {sheet_width} x {sheet_height} sheet"
             )
-            hole_center_y = (
-                start_from_y + rectangle.offset_from_bottom + (hole.height / 2)
+        position = None
+        for sheet, placed in zip(sheets, placements):
+            if sheet.free_area >= width * height - _NEST_EPSILON:
+                position = sheet.find(width, height)
+                if position is not None:
+                    break
+        if position is None:
+            sheet = _Skyline(usable_width, usable_height)
+            placed = []
+            sheets.append(sheet)
+            placements.append(placed)
+            position = sheet.find(width, height)
+            assert position is not None
+        x, y, segment = position
+        sheet.place(x, y, segment, width, height)
+        placed.append(Placement(index, margin + x, margin + y))
+    return placements
+
+
+def save_nested(
+    rectangles: Sequence[Union[Rectangle, RectangleSpec]],
+    sheet_width: float,
+    sheet_height: float,
+    filename: str,
+    spacing: float = 0.0,
+    margin: float = 0.0,
+    hatch_mode: str = "entity",
+    use_blocks: bool = False,
+    fmt: str = "asc",
+    common_line: bool = False,
+) -> List[List[Placement]]:
+    # nest() and write each sheet as {filename}_001.dxf, {filename}_002.dxf, ...
+    # through one reused DXF. Common-line cutting pays off with spacing=0.
+    sheets = nest(rectangles, sheet_width, sheet_height, spacing, margin)
+    dxf = DXF(hatch_mode, use_blocks=use_blocks, common_line=common_line)
+    for number, placements in enumerate(sheets, start=1):
+        dxf.reset()
+        for placement in placements:
+            rectangle = rectangles[placement.index]
+            if isinstance(rectangle, RectangleSpec):
+                rectangle = rectangle.to_rectangle(check=False)
+            dxf.add_rectangle(rectangle, placement.x, placement.y)
+        dxf.save(f"{filename}_{number:03d}", fmt=fmt)
+    return sheets
+
+
+def _hole_from_job(job: Dict[str, Any]) -> Hole:
+    kind = str(job.get("type", "circle")).lower()
+    if kind == "circle":
+        return Circle(float(job["radius"]))
+    if kind == "slot":
+        return Slot(float(job["radius"]), float(job["length"]), float(job["angle"]))
+    raise ValueError(f"unknown hole type {kind!r}")
+
+
+def _holes_from_job(holes: Union[str, List[Dict[str, Any]]]) -> List[Hole]:
+    # Either a list of {"type", "radius", "length", "angle", "count"} objects
+    # or, e.g. in CSV, a string like "circle:5*7;slot:5:10:0.5*3"
+    if isinstance(holes, str):
+        parsed = []
+        for item in filter(None, (item.strip() for item in holes.split(";"))):
+            item, _, count = item.partition("*")
+            kind, *values = item.split(":")
+            keys = ("radius", "length", "angle")
+            parsed.append(
+                {"type": kind, "count": count or 1, **dict(zip(keys, values))}
             )
-            if isinstance(hole, Circle):
-                self.msp.add_circle(
-                    (hole_center_x, hole_center_y),
-                    radius=hole.radius,
-                    dxfattribs=self.attribs,
-                )
-            elif isinstance(hole, Slot):
-                # TODO doesn't work correctly yet
-                # TODO add lines connecting circles
-                left_x = hole_center_x - ((hole.length / 2) * math.cos(hole.angle))
-                left_y = hole_center_y + ((hole.length / 2) * math.sin(hole.angle))
-                self.msp.add_circle(
-                    (left_x, left_y),
-                    radius=hole.radius,
-                    dxfattribs=self.attribs,
-                )
-                right_x = hole_center_x + ((hole.length / 2) * math.cos(hole.angle))
-                right_y = hole_center_y - ((hole.length / 2) * math.sin(hole.angle))
-                self.msp.add_circle(
-                    (right_x, right_y),
-                    radius=hole.radius,
-                    dxfattribs=self.attribs,
-                )
+        holes = parsed
+    result: List[Hole] = []
+    for hole in holes:
+        result.extend([_hole_from_job(hole)] * int(hole.get("count", 1)))
+    return result
+
 
-    def save(self, filename: str) -> None:
-        # Convert entities to primitives
-        primitives = disassemble.to_primitives(self.msp)
+def _floats_from_job(values: Union[str, List[Any]]) -> Tuple[float, ...]:
+    if isinstance(values, str):
+        values = [v for v in (v.strip() for v in values.split(";")) if v]
+    return tuple(float(v) for v in values)
 
-        # Collect paths from primitives:
-        paths = [p.path for p in primitives if p.path]
 
-        # Render this paths as HATCH entities
-        path.render_hatches(
-            self.msp, paths, dxfattribs={"layer": "HATCHES", "color": 2}
+def part_from_job(
+    job: Dict[str, Any], bend_table: Optional[BendTable] = None
+) -> Tuple[str, RectangleSpec]:
+    # One job file record: "frame" is "L", "U", "profile" or empty for a
+    # plain rectangle with width/height, plus the matching frame fields
+    # (profile "flanges" and "bends" as lists or "a;b;c" strings), optional
+    # thickness, material and offsets, "holes" and (JSON only) "perforation".
+    # The name becomes a file name in the output directory.
+    name = str(job["name"])
+    if not name or name in (".", "..") or any(sep in name for sep in "/\\"):
+        raise ValueError(f"invalid part name {name!r}")
+    frame = str(job.get("frame") or "").upper()
+    thickness = float(job.get("thickness", 1.0))
+    material = str(job.get("material", ""))
+    if frame == "L":
+        rectangle = Rectangle.from_L_frame(
+            L_frame(
+                float(job["width"]),
+                float(job["horizontal_length"]),
+                float(job["vertical_length"]),
+                float(job["angle"]),
+                thickness,
+                material,
+            ),
+            bend_table,
+        )
+    elif frame == "U":
+        rectangle = Rectangle.from_U_frame(
+            U_frame(
+                float(job["width"]),
+                float(job["horizontal_length"]),
+                float(job["vertical_length_left"]),
+                float(job["vertical_length_right"]),
+                float(job["angle_left"]),
+                float(job["angle_right"]),
+                thickness,
+                material,
+            ),
+            bend_table,
+        )
+    elif frame == "PROFILE":
+        rectangle = Rectangle.from_profile(
+            Profile(
+                float(job["width"]),
+                _floats_from_job(job["flanges"]),
+                _floats_from_job(job["bends"]),
+                thickness,
+                material,
+            ),
+            bend_table,
+        )
+    elif not frame:
+        rectangle = Rectangle(
+            float(job["width"]), float(job["height"]), thickness=thickness
         )
+    else:
+        raise ValueError(f"unknown frame {frame!r}")
 
-        self.doc.set_modelspace_vport(15, (4, 4))
-        self.doc.saveas(DIR / f"{filename}.dxf")
+    if "offset_from_side" in job:
+        rectangle.offset_from_side = float(job["offset_from_side"])
+    if "offset_from_bottom" in job:
+        rectangle.offset_from_bottom = float(job["offset_from_bottom"])
+    rectangle.add_holes(_holes_from_job(job.get("holes", [])), check=False)
+    if "perforation" in job:
+        perforation = job["perforation"]
+        rectangle.add_perforation(
+            Perforation(
+                _hole_from_job(perforation["hole"]),
+                int(perforation["rows"]),
+                int(perforation["columns"]),
+                float(perforation["pitch_x"]),
+                float(perforation["pitch_y"]),
+                bool(perforation.get("stagger", False)),
+            ),
+            check=False,
+        )
+    return name, rectangle.spec()
 
 
-if __name__ == "__main__":
-    """
+def _job_record(job: object) -> Union[Dict[str, Any], ValueError]:
+    if isinstance(job, dict):
+        return job
+    return ValueError(f"job record must be an object, not {type(job).__name__}")
+
+
+def read_jobs(
+    filename: Union[str, Path]
+) -> Iterator[Union[Dict[str, Any], ValueError]]:
+    # Records of a .csv, .jsonl or .json (list or {"jobs": [...]}) job file.
+    # JSON that doesn't parse or isn't an object is yielded as its error in
+    # place of the record, so one bad line doesn't end the file.
+    path = Path(filename)
+    suffix = path.suffix.lower()
+    with open(path, newline="") as stream:
+        if suffix == ".csv":
+            for row in csv.DictReader(stream):
+                yield {key: value for key, value in row.items() if value}
+        elif suffix == ".jsonl":
+            for line in stream:
+                if line.strip():
+                    try:
+                        yield _job_record(json.loads(line))
+                    except json.JSONDecodeError as exception:
+                        yield exception
+        elif suffix == ".json":
+            try:
+                data = json.load(stream)
+            except json.JSONDecodeError as exception:
+                yield exception
+                return
+            if isinstance(data, dict):
+                data = data.get("jobs")
+            if not isinstance(data, list):
+                yield ValueError('expected a list of jobs or {"jobs": [...]}')
+                return
+            for job in data:
+                yield _job_record(job)
+        else:
+            raise ValueError(f"unsupported job file {path.name}")
+
+
+def load_jobs(
+    filenames: List[str], bend_table: Optional[BendTable] = None
+) -> Tuple[List[Tuple[str, RectangleSpec]], List[str]]:
+    # (name, spec) per part instance of the job files, without the jobs that
+    # don't parse or don't validate, and the errors for those. Each job is
+    # validated once, before it is expanded by its quantity.
+    errors = []
+    jobs: List[Tuple[str, RectangleSpec, int]] = []
+    for filename in filenames:
+        for record, job in enumerate(read_jobs(filename), start=1):
+            try:
+                if isinstance(job, ValueError):
+                    raise job
+                name, spec = part_from_job(job, bend_table)
+                quantity = int(job.get("quantity", 1))
+            except (KeyError, TypeError, ValueError) as exception:
+                errors.append(f"{filename} record {record}: {exception!r}")
+                continue
+            jobs.append((name, spec, quantity))
+
+    invalid = set()
+    for violation in validate_rectangles(spec for _, spec, _ in jobs):
+        name = jobs[violation.rectangle][0]
+        invalid.add(violation.rectangle)
+        hole = "" if violation.hole is None else f" (hole {violation.hole})"
+        errors.append(f"{name}: {violation.message}{hole}")
+    parts = []
+    for index, (name, spec, quantity) in enumerate(jobs):
+        if index not in invalid:
+            parts.extend([(name, spec)] * quantity)
+    return parts, errors
+
+
+def run_jobs(
+    filenames: List[str],
+    output_dir: Union[str, Path] = ".",
+    hatch_mode: str = "entity",
+    use_blocks: bool = False,
+    fmt: str = "asc",
+    cache: Optional[PartCache] = None,
+    workers: int = 1,
+    keep_going: bool = False,
+    bend_table: Optional[BendTable] = None,
+) -> Tuple[List[ManifestEntry], List[str]]:
+    # Parses and validates every job before generating anything. Invalid jobs
+    # stop the run, or with keep_going are reported and left out.
+    parts, errors = load_jobs(filenames, bend_table)
+    if errors and not keep_going:
+        return [], errors
+    manifest = generate_batch(
+        parts, output_dir, hatch_mode, use_blocks, fmt, cache, workers
+    )
+    return manifest, errors
+
+
+def nest_jobs(
+    filenames: List[str],
+    sheet_width: float,
+    sheet_height: float,
+    spacing: float = 0.0,
+    margin: float = 0.0,
+    output_dir: Union[str, Path] = ".",
+    hatch_mode: str = "entity",
+    use_blocks: bool = False,
+    fmt: str = "asc",
+    keep_going: bool = False,
+    bend_table: Optional[BendTable] = None,
+    common_line: bool = False,
+) -> Tuple[List[List[Placement]], List[str]]:
+    # Like run_jobs() but every part instance is nested onto sheets, written
+    # as sheet_001.dxf, ... with nesting.csv listing where each part went.
+    # Parts too large for the sheet are reported like invalid jobs.
+    parts, errors = load_jobs(filenames, bend_table)
+    usable_width = sheet_width - 2 * margin + _NEST_EPSILON
+    usable_height = sheet_height - 2 * margin + _NEST_EPSILON
+    too_large = set()
+    for name, spec in parts:
+        if spec.width > usable_width or spec.height > usable_height:
+            if (name, spec) not in too_large:
+                too_large.add((name, spec))
+                errors.append(
+                    f"{name}: {spec.width} x {spec.height} doesn't fit on a"
+                    f" {sheet_width} x {sheet_height} sheet"
+                )
+    parts = [part for part in parts if part not in too_large]
+    if errors and not keep_going:
+        return [], errors
+    output_dir = (DIR / output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    sheets = save_nested(
+        [spec for _, spec in parts],
+        sheet_width,
+        sheet_height,
+        str(output_dir / "sheet"),
+        spacing,
+        margin,
+        hatch_mode,
+        use_blocks,
+        fmt,
+        common_line,
+    )
+    with open(output_dir / "nesting.csv", "w", newline="") as stream:
+        writer = csv.writer(stream)
+        writer.writerow(["file", "part", "x", "y"])
+        for number, placements in enumerate(sheets, start=1):
+            for placement in placements:
+                name = parts[placement.index][0]
+                filename = f"sheet_{number:03d}.dxf"
+                writer.writerow([filename, name, placement.x, placement.y])
+    return sheets, errors
+
+
+def add_hatches(
+    filename: str, hatch_mode: str = "entity", output: str = "", fmt: str = "asc"
+) -> None:
+    # Deferred hatching of a file written with hatch_mode="none"
+    DXF.load(filename, hatch_mode).save(output or filename, fmt=fmt)
+
+
+def benchmark(parts: int, holes: int) -> List[Tuple[str, str, float, int]]:
+    # (backend, fmt, seconds, bytes) for writing the same sheet every way.
+    # DXF rows only time save(), DXFStream rows time the whole write.
+    rectangle = Rectangle(
+        width=200, height=50, offset_from_side=6, offset_from_bottom=10
+    )
+    rectangle.add_holes([Circle(radius=5) for _ in range(holes)])
+    pitch = rectangle.height + 10
     dxf = DXF()
+    for i in range(parts):
+        dxf.add_rectangle(rectangle, start_from_y=i * pitch)
 
-    l_frame = L_frame(width=200, horizontal_length=50, vertical_length=10, angle=90)
-    rectangle_1 = Rectangle.from_L_frame(l_frame)
-    rectangle_1.offset_from_side = 6
-    rectangle_1.offset_from_bottom = 10
-    rectangle_1.add_holes([Circle(radius=5) for _ in range(7)])
-    dxf.add_rectangle(rectangle_1)
-
-    rectangle_2 = Rectangle(
-        width=150, height=50, offset_from_side=40, offset_from_bottom=5
-    )
-    rectangle_2.add_holes(
-        [
-            Slot(radius=5, length=10, angle=45),
-            Slot(radius=5, length=10, angle=45),
-            Slot(radius=5, length=10, angle=45),
-        ]
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in FORMATS:
+            filename = Path(directory) / f"dxf_{fmt}"
+            start = time.perf_counter()
+            dxf.save(str(filename), fmt=fmt)
+            seconds = time.perf_counter() - start
+            size = filename.with_suffix(".dxf").stat().st_size
+            rows.append(("DXF", fmt, seconds, size))
+
+        for fmt in FORMATS:
+            filename = Path(directory) / f"stream_{fmt}.dxf"
+            start = time.perf_counter()
+            with DXFStream.open(filename, fmt=fmt) as stream:
+                for i in range(parts):
+                    stream.add_rectangle(rectangle, start_from_y=i * pitch)
+            seconds = time.perf_counter() - start
+            rows.append(("DXFStream", fmt, seconds, filename.stat().st_size))
+    return rows
+
+
+def _strip_dxf_suffix(filename: str) -> str:
+    return filename[: -len(".dxf")] if filename.lower().endswith(".dxf") else filename
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Generate dxf for rectangle with evenly spaced holes"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    hatch_parser = subparsers.add_parser(
+        "hatch", help="add hatches to an already written (cut-only) dxf"
+    )
+    hatch_parser.add_argument("filename")
+    hatch_parser.add_argument(
+        "--hatch-mode", choices=("entity", "rectangle"), default="entity"
+    )
+    hatch_parser.add_argument(
+        "-o", "--output", default="", help="defaults to overwriting the input file"
+    )
+    hatch_parser.add_argument("--fmt", choices=FORMATS, default="asc")
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="compare write time and file size of the output formats"
+    )
+    bench_parser.add_argument("--parts", type=int, default=100)
+    bench_parser.add_argument("--holes", type=int, default=7)
+
+    batch_parser = subparsers.add_parser(
+        "batch", help="generate all parts of csv/json/jsonl job files"
+    )
+    batch_parser.add_argument("job_files", nargs="+")
+    batch_parser.add_argument("-o", "--output-dir", default=".")
+    batch_parser.add_argument("-j", "--jobs", type=int, default=1, help="processes")
+    batch_parser.add_argument("--hatch-mode", choices=HATCH_MODES, default="entity")
+    batch_parser.add_argument("--fmt", choices=FORMATS, default="asc")
+    batch_parser.add_argument("--blocks", action="store_true", help="holes as blocks")
+    batch_parser.add_argument("--cache", default="", help="part cache directory")
+    batch_parser.add_argument("--cache-size", type=int, default=1000)
+    batch_parser.add_argument("--bend-table", default="", help="bend deduction csv")
+    batch_parser.add_argument(
+        "--keep-going",
+        action="store_true",
+        help="skip invalid jobs instead of generating nothing",
+    )
+
+    nest_parser = subparsers.add_parser(
+        "nest", help="nest all parts of csv/json/jsonl job files onto sheets"
+    )
+    nest_parser.add_argument("job_files", nargs="+")
+    nest_parser.add_argument("--sheet-width", type=float, required=True)
+    nest_parser.add_argument("--sheet-height", type=float, required=True)
+    nest_parser.add_argument("--spacing", type=float, default=0.0)
+    nest_parser.add_argument("--margin", type=float, default=0.0)
+    nest_parser.add_argument("-o", "--output-dir", default=".")
+    nest_parser.add_argument("--hatch-mode", choices=HATCH_MODES, default="entity")
+    nest_parser.add_argument("--fmt", choices=FORMATS, default="asc")
+    nest_parser.add_argument("--blocks", action="store_true", help="holes as blocks")
+    nest_parser.add_argument("--bend-table", default="", help="bend deduction csv")
+    nest_parser.add_argument(
+        "--common-line",
+        action="store_true",
+        help="cut shared edges of touching parts once",
+    )
+    nest_parser.add_argument(
+        "--keep-going",
+        action="store_true",
+        help="skip invalid jobs instead of nesting nothing",
     )
-    dxf.add_rectangle(rectangle_2, start_from_x=0, start_from_y=rectangle_1.height + 20.0)
 
-    dxf.save("demo")
-    """
+    args = parser.parse_args(argv)
+    if args.command == "hatch":
+        add_hatches(
+            _strip_dxf_suffix(args.filename),
+            args.hatch_mode,
+            _strip_dxf_suffix(args.output),
+            args.fmt,
+        )
+    elif args.command == "bench":
+        print(f"{'backend':<10} {'fmt':<4} {'seconds':>9} {'bytes':>10}")
+        for backend, fmt, seconds, size in benchmark(args.parts, args.holes):
+            print(f"{backend:<10} {fmt:<4} {seconds:>9.4f} {size:>10}")
+    elif args.command == "batch":
+        manifest, errors = run_jobs(
+            args.job_files,
+            args.output_dir,
+            args.hatch_mode,
+            args.blocks,
+            args.fmt,
+            PartCache(args.cache, args.cache_size) if args.cache else None,
+            args.jobs,
+            args.keep_going,
+            BendTable.load(args.bend_table) if args.bend_table else None,
+        )
+        for error in errors:
+            print(error, file=sys.stderr)
+        quantity = sum(entry.quantity for entry in manifest)
+        print(f"{len(manifest)} files for {quantity} parts, {len(errors)} errors")
+        return 1 if errors else 0
+    elif args.command == "nest":
+        sheets, errors = nest_jobs(
+            args.job_files,
+            args.sheet_width,
+            args.sheet_height,
+            args.spacing,
+            args.margin,
+            args.output_dir,
+            args.hatch_mode,
+            args.blocks,
+            args.fmt,
+            args.keep_going,
+            BendTable.load(args.bend_table) if args.bend_table else None,
+            args.common_line,
+        )
+        for error in errors:
+            print(error, file=sys.stderr)
+        quantity = sum(len(placements) for placements in sheets)
+        print(f"{len(sheets)} sheets for {quantity} parts, {len(errors)} errors")
+        return 1 if errors else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+from collections import Counter
+
+import pytest
+
+from generate_dxf import common_line_paths
+
+
+def cut_edges(paths):
+    # Unit-free count of how often each straight piece between two path
+    # points is cut, split at every x and y where any path turns
+    xs = sorted({x for points, _ in paths for x, _ in points})
+    ys = sorted({y for points, _ in paths for _, y in points})
+    counts = Counter()
+    for points, closed in paths:
+        pairs = list(zip(points, points[1:]))
+        if closed:
+            pairs.append((points[-1], points[0]))
+        for (ax, ay), (bx, by) in pairs:
+            assert ax == bx or ay == by
+            if ax == bx:
+                low, high = sorted((ay, by))
+                stops = [y for y in ys if low <= y <= high]
+                counts.update(((ax, a), (ax, b)) for a, b in zip(stops, stops[1:]))
+            else:
+                low, high = sorted((ax, bx))
+                stops = [x for x in xs if low <= x <= high]
+                counts.update(((a, ay), (b, ay)) for a, b in zip(stops, stops[1:]))
+    return counts
+
+
+def test_isolated_box_is_closed_rectangle():
+    paths = common_line_paths([(0, 0, 10, 5)])
+    assert len(paths) == 1
+    points, closed = paths[0]
+    assert closed
+    assert sorted(points) == [(0, 0), (0, 5), (10, 0), (10, 5)]
+
+
+def test_separate_boxes_stay_closed():
+    paths = common_line_paths([(0, 0, 10, 5), (20, 0, 30, 5)])
+    assert [closed for _, closed in paths] == [True, True]
+    assert all(len(points) == 4 for points, _ in paths)
+
+
+@pytest.mark.parametrize(
+    "boxes",
+    [
+        [(0, 0, 10, 5), (10, 0, 20, 5)],
+        [(0, 0, 10, 5), (10, 0, 20, 5), (0, 5, 20, 8)],
+        [(0, 0, 10, 5), (10, 2, 20, 7)],
+        [(x, y, x + 10, y + 5) for x in range(0, 30, 10) for y in range(0, 10, 5)],
+    ],
+)
+def test_shared_edges_cut_once(boxes):
+    counts = cut_edges(common_line_paths(boxes))
+    assert set(counts.values()) == {1}
+    # Every box edge is covered: the total cut length is the length of the
+    # union of the box outlines
+    length = sum(abs(b[0] - a[0]) + abs(b[1] - a[1]) for a, b in counts)
+    expected = cut_edges(
+        [
+            ([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], True)
+            for x0, y0, x1, y1 in boxes
+        ]
+    )
+    assert length == sum(abs(b[0] - a[0]) + abs(b[1] - a[1]) for a, b in expected)
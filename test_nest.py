@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from generate_dxf import Rectangle, nest
+
+SHEET_WIDTH = 3000
+SHEET_HEIGHT = 1500
+SPACING = 5
+MARGIN = 10
+
+
+@pytest.fixture
+def rectangles():
+    rng = np.random.default_rng(3)
+    sizes = zip(rng.integers(20, 400, 300), rng.integers(10, 150, 300))
+    return [Rectangle(float(width), float(height)) for width, height in sizes]
+
+
+def test_every_part_placed_once(rectangles):
+    sheets = nest(rectangles, SHEET_WIDTH, SHEET_HEIGHT, SPACING, MARGIN)
+    placed = sorted(p.index for sheet in sheets for p in sheet)
+    assert placed == list(range(len(rectangles)))
+
+
+def test_no_overlap_spacing_and_margin(rectangles):
+    sheets = nest(rectangles, SHEET_WIDTH, SHEET_HEIGHT, SPACING, MARGIN)
+    for sheet in sheets:
+        boxes = np.array(
+            [
+                (
+                    p.x,
+                    p.y,
+                    p.x + rectangles[p.index].width,
+                    p.y + rectangles[p.index].height,
+                )
+                for p in sheet
+            ]
+        )
+        assert boxes[:, :2].min() >= MARGIN - 1e-9
+        assert boxes[:, 2].max() <= SHEET_WIDTH - MARGIN + 1e-9
+        assert boxes[:, 3].max() <= SHEET_HEIGHT - MARGIN + 1e-9
+        for i, (x0, y0, x1, y1) in enumerate(boxes):
+            others = boxes[i + 1 :]
+            # Gap along whichever axis separates the two boxes
+            gap = np.maximum(
+                np.maximum(others[:, 0] - x1, x0 - others[:, 2]),
+                np.maximum(others[:, 1] - y1, y0 - others[:, 3]),
+            )
+            assert (gap >= SPACING - 1e-9).all()
+
+
+def test_part_larger_than_sheet_raises():
+    with pytest.raises(ValueError):
+        nest([Rectangle(SHEET_WIDTH, 10)], SHEET_WIDTH, SHEET_HEIGHT, margin=MARGIN)
+
+
+def test_no_parts():
+    assert nest([], SHEET_WIDTH, SHEET_HEIGHT) == []